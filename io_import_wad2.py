@@ -26,16 +26,97 @@ bl_info = {
     "doc_url": "https://github.com/c-d-a/io_import_wad2"
 }
 
-import bpy, struct, bmesh, math
+import bpy, struct, bmesh, math, os, re, zlib, hashlib, tempfile, getpass
+import numpy as np
 from bpy_extras.io_utils import ImportHelper
 from bpy.props import *
+from bpy.app.handlers import persistent
 from os.path import isfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
 if bpy.app.version < (4,0,0):
     em_socket = 'Emission'
 else:
     em_socket = 'Emission Color'
 
+wad_header = struct.Struct('<2l')
+wad_entry = struct.Struct('<3lcch16s')
+bsp_header = struct.Struct('<30l')
+bsp_version = struct.pack('<L', 29)
+lump_count = struct.Struct('<l')
+miptex_header = struct.Struct('<16s6L')
+pic_header = struct.Struct('<2l')
+
+noodles_version = 2 # bump whenever make_noodles_groups changes
+
+def write_png(filepath, pixels):
+    # bare-bones encoder for asset previews, safe to run off the main thread
+    # (zlib releases the GIL); pixels are float rows in bottom-up order
+    height, width, channels = pixels.shape
+    rows = np.zeros((height, 1 + width*channels), np.uint8) # filter type 0
+    rows[:,1:] = (pixels[::-1] * 255 + 0.5).clip(0, 255).reshape(height, -1)
+    color_type = {1:0, 2:4, 3:2, 4:6}[channels]
+    def chunk(tag, body):
+        size, crc = len(body), zlib.crc32(tag + body)
+        return struct.pack('>L', size) + tag + body + struct.pack('>L', crc)
+    folder = os.path.dirname(filepath)
+    os.makedirs(folder, exist_ok=True)
+    # unique temp name, other instances may be writing the same preview
+    png = tempfile.NamedTemporaryFile(dir=folder, suffix='.tmp', delete=False)
+    try:
+        with png:
+            png.write(b'\x89PNG\r\n\x1a\n')
+            png.write(chunk(b'IHDR', struct.pack('>2L5B', width, height,
+                                                    8, color_type, 0, 0, 0)))
+            png.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 1)))
+            png.write(chunk(b'IEND', b''))
+        os.replace(png.name, filepath) # never leave a partial file
+    except OSError:
+        os.remove(png.name)
+        if not isfile(filepath):
+            raise
+
+def preview_cache_dir():
+    # shared temp dirs can be claimed or planted by other users, so keep a
+    # private per-user folder and use the session temp dir if that fails
+    try:
+        folder = f"{tempfile.gettempdir()}/{__name__}-{getpass.getuser()}"
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+        st = os.stat(folder)
+        if hasattr(os, 'getuid'):
+            if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                raise PermissionError(folder)
+        return f"{folder}/previews"
+    except Exception:
+        return f"{bpy.app.tempdir}{__name__}/previews"
+
+def palette_to_rgba(palette):
+    # 768 bytes of RGB to a float RGBA lookup table
+    rgba = np.ones((256,4), np.float32)
+    rgba[:,:3] = np.frombuffer(palette, np.uint8, 768).reshape(256,3)
+    rgba[:,:3] /= 255
+    return rgba
+
+def indexed_to_rgba(pixels, size, palette, name, cut_luma):
+    # bottom-up RGBA floats, plus the fullbright part (None if there's none)
+    idx = np.frombuffer(pixels, np.uint8).reshape(size[1], size[0])[::-1]
+    rgba = palette[idx]
+    emit = None
+    is_fb = idx >= 224
+    is_fb &= not name.startswith(('sky','*'))
+    if name[0] == '{':
+        alpha = idx != 255
+        rgba[...,3] = alpha
+        is_fb &= alpha
+    if is_fb.any():
+        emit = np.empty_like(rgba)
+        emit[:] = 0,0,0,1
+        np.copyto(emit, rgba, where=is_fb[...,None])
+        if cut_luma:
+            rgba[is_fb] = 0,0,0,1
+    return rgba, emit
+
 class ImportQuakeWadPreferences(bpy.types.AddonPreferences):
     bl_idname = __name__
     basepath: StringProperty(name="Base path", default='', subtype='DIR_PATH',
@@ -79,10 +160,20 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
         description="Smoothly blend frames in animated image sequences")
 
     def execute(self, context):
+        # previews are encoded in the background, only when they'll be used
+        if self.option_assets and bpy.app.version > (3,0,0):
+            with ThreadPoolExecutor() as pool:
+                return self.import_files(pool)
+        return self.import_files(None)
+
+    def import_files(self, pool):
         prefs = bpy.context.preferences.addons[__name__].preferences
-        pal_float = [rgb/255 for rgb in quake1palette]
         emit_suffix = prefs.emit_suffix if prefs.emit_suffix else '_luma'
         anim_seqs = dict()
+        previews = []
+        preview_jobs = dict()
+        failed = set()
+        preview_dir = preview_cache_dir() if pool is not None else None
         if self.option_turb or self.option_scroll:
             self.make_noodles_pre()
         if self.option_cont:
@@ -98,23 +189,26 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
             loose_texture = False
             with open (self.directory + file.name, 'rb') as wad:
 
-                # determine format
+                # determine format, only slurp the file if it's ours
                 sig = wad.read(4)
+                if sig in (b'WAD2', b'BSP2', bsp_version):
+                    wad.seek(0)
+                    data = memoryview(wad.read())
                 if sig == b'WAD2':
-                    numentries, diroffset = struct.unpack('<2l', wad.read(2*4))
-                    wad.seek(diroffset)
-                    fmt = '<3lcch16s'
-                    fmtsize = struct.calcsize(fmt)
-                    for i in range(numentries):
-                        wadentries.append(struct.unpack(fmt,wad.read(fmtsize)))
-                elif sig == b'BSP2' or sig == struct.pack('<L',29):
-                    header = struct.unpack('<30l',wad.read(30*4))
+                    numentries, diroffset = wad_header.unpack_from(data, 4)
+                    dirsize = numentries * wad_entry.size
+                    wadentries = list(wad_entry.iter_unpack(
+                                    data[diroffset : diroffset + dirsize]))
+                elif sig == b'BSP2' or sig == bsp_version:
+                    header = bsp_header.unpack_from(data, 4)
                     diroffset = header[4]
-                    wad.seek(diroffset)
-                    numentries = struct.unpack('<l',wad.read(4))[0]
-                    for i in range(numentries):
-                        offset = struct.unpack('<l',wad.read(4))[0] + diroffset
-                        wadentries.append([offset, 0, 0, b'D', 0, 0, b''])
+                    numentries, = lump_count.unpack_from(data, diroffset)
+                    start = diroffset + lump_count.size
+                    dirsize = numentries * lump_count.size
+                    offsets = lump_count.iter_unpack(
+                                    data[start : start + dirsize])
+                    wadentries = [[diroffset + offset, 0, 0, b'D', 0, 0, b'']
+                                    for offset, in offsets]
                 else:
                     # can't load PCX, indexed TGAs have wrong previews
                     img24 = bpy.data.images.load(self.directory + file.name)
@@ -144,11 +238,12 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
                         wad_coll.objects.link(ob)
 
                 # parse textures
+                file_mats = []
                 for wadentry in wadentries:
-                    wad.seek(wadentry[0])
+                    offset = wadentry[0]
                     type = wadentry[3]
-                    name = wadentry[6].split(b'\00')[0].decode('ascii')
-                    palette = pal_float
+                    name = wadentry[6].partition(b'\00')[0].decode('ascii')
+                    palette = quake1palette_rgba
                     if loose_texture:
                         if not self.option_rel:
                             name = file.name
@@ -165,26 +260,24 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
                         name = name[:name.rfind('.')].replace('#','*')
                     elif name == 'CONCHARS':
                         size = 128, 128
-                        pixels = wad.read(128*128)
+                        pixels = data[offset : offset + 128*128]
                     elif name == 'CONBACK':
                         size = 320, 200
-                        pixels = wad.read(320*200)
+                        pixels = data[offset : offset + 320*200]
                     elif type == b'D': # miptexture
-                        fmt = '<16s6L'
-                        fmtsize = struct.calcsize(fmt)
-                        miptex = struct.unpack(fmt, wad.read(fmtsize))
-                        name = miptex[0].split(b'\00')[0].decode('ascii')
+                        miptex = miptex_header.unpack_from(data, offset)
+                        name = miptex[0].partition(b'\00')[0].decode('ascii')
                         size = miptex[1], miptex[2]
-                        wad.seek(wadentry[0]+miptex[3])
-                        pixels = wad.read(size[0]*size[1])
+                        offset += miptex[3]
+                        pixels = data[offset : offset + size[0]*size[1]]
                     elif type == b'B': # statusbar
-                        size = struct.unpack('<2l', wad.read(8))
-                        pixels = wad.read(size[0]*size[1])
+                        size = pic_header.unpack_from(data, offset)
+                        offset += pic_header.size
+                        pixels = data[offset : offset + size[0]*size[1]]
                     elif type == b'@': # palette
                         size = 16, 16
                         pixels = bytearray(range(256))
-                        newpal = struct.unpack('<768B', wad.read(768))
-                        palette = [rgb/255 for rgb in newpal]
+                        palette = palette_to_rgba(data[offset:offset+768])
                     else:
                         self.report({'WARNING'},f"Unrecognized lump {name}")
                         continue
@@ -192,12 +285,12 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
                     # skip duplicates and other unneeded textures
                     name = name.lower()
                     ename = name + emit_suffix
-                    if name in bpy.data.materials:
-                        if self.option_cont:
-                            ob.data.materials.append(bpy.data.materials[name])
-                        bpy.data.materials[name].asset_data.tags.new(cont_name)
+                    is_frame = name[0] == '+' and name[1] not in '0a'
+                    mat = bpy.data.materials.get(name)
+                    if mat is not None:
+                        file_mats.append(mat)
                         continue
-                    if name[0] == '+' and name[1] not in '0a':
+                    if is_frame:
                         if not self.option_seq:
                             continue
                         seq_name = '+0' if name[1] in '0123456789' else '+a'
@@ -216,8 +309,7 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
                         bpy.data.images.remove(img24)
                         continue
 
-                    pix_rgba = []
-                    pix_emit = []
+                    pix_emit = None
                     if loose_texture: # use loaded image + look for emission
                         img = img24
                         img.name = name
@@ -235,65 +327,47 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
                                 emit.pack()
                                 pix_emit = 'blah'
                     else: # convert from indexed to RGBA + emission
-                        for row in reversed(range(size[1])):
-                            for clm in range(size[0]):
-                                pixel = pixels[row*size[0] + clm]
-                                color = palette[pixel*3 : pixel*3+3]
-                                alpha = pixel != 255 or name[0] != '{'
-                                notfb = pixel < 224 or name.startswith(
-                                                            ('sky','*'))
-                                if notfb or not alpha:
-                                    pix_rgba.extend(color+[alpha])
-                                    if pix_emit:
-                                        pix_emit.extend([0,0,0,1])
-                                else:
-                                    if self.option_luma:
-                                        pix_rgba.extend([0,0,0,1])
-                                    else:
-                                        pix_rgba.extend(color+[alpha])
-                                    if not pix_emit:
-                                        initsize = (size[1]-row-1)*size[0] +clm
-                                        pix_emit = [0,0,0,1]*initsize
-                                    pix_emit.extend(color+[alpha])
+                        pix_rgba, pix_emit = indexed_to_rgba(pixels, size,
+                                            palette, name, self.option_luma)
                         img = bpy.data.images.new(name,size[0],size[1])
-                        img.pixels = pix_rgba
+                        img.pixels.foreach_set(pix_rgba.ravel())
                         img.pack()
-                        if pix_emit:
+                        if pix_emit is not None:
                             emit = bpy.data.images.new(ename,size[0],size[1])
-                            emit.pixels = pix_emit
+                            emit.pixels.foreach_set(pix_emit.ravel())
                             emit.pack()
 
                     # stash sequence frames
-                    if name[0] == '+' and name[1] not in '0a':
+                    if is_frame:
                         if seq_name in anim_seqs.keys():
                             anim_seqs[seq_name].append(img)
-                            if pix_emit:
+                            if pix_emit is not None:
                                 anim_seqs[seq_name + emit_suffix].append(emit)
                         else:
                             anim_seqs[seq_name] = [img]
-                            if pix_emit:
+                            if pix_emit is not None:
                                 anim_seqs[seq_name + emit_suffix] = [emit]
                         continue
 
                     # create the material
                     mat = bpy.data.materials.new(name)
-                    if self.option_cont:
-                        ob.data.materials.append(mat)
+                    file_mats.append(mat)
                     mat.use_nodes = True
                     mat.preview_render_type = 'FLAT'
-                    shader = mat.node_tree.nodes['Principled BSDF']
+                    nodes = mat.node_tree.nodes
+                    links = mat.node_tree.links
+                    shader = nodes['Principled BSDF']
                     if bpy.app.version < (4,0,0):
                         shader.inputs['Specular'].default_value = 0.0
                     else:
                         shader.inputs['Specular IOR Level'].default_value = 0.0
-                    img_n = mat.node_tree.nodes.new('ShaderNodeTexImage')
+                    img_n = nodes.new('ShaderNodeTexImage')
                     img_n.image = img
                     img_n.interpolation = 'Closest'
                     img_n.location = -280, 300
-                    links = mat.node_tree.links
                     links.new(img_n.outputs[0], shader.inputs['Base Color'])
-                    if pix_emit:
-                        emit_n = mat.node_tree.nodes.new('ShaderNodeTexImage')
+                    if pix_emit is not None:
+                        emit_n = nodes.new('ShaderNodeTexImage')
                         emit_n.image = emit
                         emit_n.interpolation = 'Closest'
                         emit_n.location = -280, -48
@@ -305,30 +379,31 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
                         mat.shadow_method = 'CLIP'
                     else:
                         mat.use_backface_culling = True
-                    if name.startswith(('sky','*lava','*tele')):
+                    is_sky = name.startswith('sky')
+                    is_lit = name.startswith(('*lava','*tele'))
+                    if is_sky or is_lit:
                         links.new(img_n.outputs[0], shader.inputs[em_socket])
                         shader.inputs['Emission Strength'].default_value = 1.0
                         links.remove(shader.inputs['Base Color'].links[0])
                         shader.inputs['Base Color'].default_value = [0,0,0,1]
                     if name[0] in ('*','#'):
                         if self.option_turb:
-                            warp_n = mat.node_tree.nodes.new('ShaderNodeGroup')
+                            warp_n = nodes.new('ShaderNodeGroup')
                             warp_n.node_tree = bpy.data.node_groups['watwarp']
                             warp_n.location = -460, 300
                             links.new(warp_n.outputs[0], img_n.inputs[0])
-                        if not name.startswith(('*lava','*tele')):
+                        if not is_lit:
                             shader.inputs['Alpha'].default_value = 0.75
                             mat.blend_method = 'BLEND'
                             mat.shadow_method = 'HASHED'
-                    if name.startswith('sky') and self.option_scroll:
+                    if is_sky and self.option_scroll:
                         mat.shadow_method = 'NONE'
                         output = shader.outputs[0].links[0].to_node
-                        tree = mat.node_tree
-                        tree.nodes.remove(shader) # leave image for Workbench
-                        warp_n = tree.nodes.new('ShaderNodeGroup')
+                        nodes.remove(shader) # leave image for Workbench
+                        warp_n = nodes.new('ShaderNodeGroup')
                         warp_n.location = 0, 300
                         warp_n.node_tree = bpy.data.node_groups['skyportal']
-                        tree.links.new(warp_n.outputs[0], output.inputs[0])
+                        links.new(warp_n.outputs[0], output.inputs[0])
                         sky = bpy.data.worlds.new(name+"*world")
                         sky.use_nodes = True
                         sky.use_fake_user = True
@@ -353,18 +428,47 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
                         tree.links.new(warp_n.outputs[0], output.inputs[0])
 
                     # mark as asset
-                    if self.option_assets and bpy.app.version > (3,0,0):
+                    if pool is not None:
                         mat.asset_mark()
-                        mat.asset_data.tags.new(cont_name)
                         img.filepath = f"{tempdir}/{name.replace('*','#')}.png"
-                        img.save()
-                        if bpy.app.version < (4, 0, 0):
-                            bpy.ops.ed.lib_id_load_custom_preview( {"id": mat},
-                                        filepath=img.filepath)
-                        else:
-                            with bpy.context.temp_override(id = mat):
-                                bpy.ops.ed.lib_id_load_custom_preview(
-                                        filepath=img.filepath)
+                        if loose_texture:
+                            pix_rgba = np.empty(len(img.pixels), np.float32)
+                            img.pixels.foreach_get(pix_rgba)
+                            pix_rgba = pix_rgba.reshape(img.size[1],
+                                                        img.size[0], -1)
+                        # previews are cached by content across sessions
+                        digest = hashlib.blake2b(pix_rgba, digest_size=8)
+                        digest.update(struct.pack('<3L', *pix_rgba.shape))
+                        png_path = f"{preview_dir}/{digest.hexdigest()}.png"
+                        if not (png_path in preview_jobs or isfile(png_path)):
+                            preview_jobs[png_path] = pool.submit(write_png,
+                                                        png_path, pix_rgba)
+                        previews.append((mat, png_path))
+
+                # fill the container and tag assets in one go
+                for mat in file_mats:
+                    if self.option_cont:
+                        ob.data.materials.append(mat)
+                    if mat.asset_data:
+                        mat.asset_data.tags.new(cont_name)
+
+        # load previews once written, a failed one shouldn't fail the import
+        for png_path, job in preview_jobs.items():
+            try:
+                job.result()
+            except Exception as err:
+                self.report({'WARNING'},f"Could not write preview: {err}")
+                failed.add(png_path)
+        for mat, png_path in previews:
+            if png_path in failed:
+                continue
+            if bpy.app.version < (4, 0, 0):
+                bpy.ops.ed.lib_id_load_custom_preview( {"id": mat},
+                            filepath=png_path)
+            else:
+                with bpy.context.temp_override(id = mat):
+                    bpy.ops.ed.lib_id_load_custom_preview(
+                            filepath=png_path)
 
         if self.option_seq:
             self.make_noodles_post(anim_seqs)
@@ -393,305 +497,360 @@ class ImportQuakeWad(bpy.types.Operator, ImportHelper):
             if seq_name not in bpy.data.materials:
                 continue
             mat = bpy.data.materials[seq_name]
-            shader = mat.node_tree.nodes['Principled BSDF']
+            nodes = mat.node_tree.nodes
             links = mat.node_tree.links
+            shader = nodes['Principled BSDF']
             frm0 = shader.inputs['Base Color'].links[0].from_node
-            if frm0.type == 'MIX_RGB':
+            if frm0.type in ('GROUP', 'MIX_RGB'):
                 continue # (fix me?) already set up during previous import
             ename = seq_name + emit_suffix
-            fr_mod = (len(anim_seqs[seq_name]) + 1) * fr_dur
-            if self.option_lerp:
-                drv_ex = f"-(frame % {fr_mod})/{fr_dur} +"
-            else:
-                drv_ex = f"frame % {fr_mod} < {fr_dur} * "
+            frames = anim_seqs[seq_name]
+            frames.sort(key=lambda frame: frame.name)
+            group = self.make_noodles_seq(len(frames) + 1, fr_dur)
 
-            mix1 = mat.node_tree.nodes.new('ShaderNodeMixRGB')
-            mix1.location = -180, 220
-            drv = mix1.inputs[0].driver_add('default_value')
-            drv.driver.expression = f"{drv_ex}1"
-            frm0.location = -280, 260
+            seq_n = nodes.new('ShaderNodeGroup')
+            seq_n.node_tree = group
+            seq_n.location = -180, 220
+            frm0.location = -460, 260
             frm0.hide = True
-            links.new(frm0.outputs[0], mix1.inputs[2])
-            links.new(mix1.outputs[0], shader.inputs['Base Color'])
-
-            has_emit_frames = ( shader.inputs[em_socket].links
-                                or ename in anim_seqs.keys() )
-            if has_emit_frames:
-                emix1 = mat.node_tree.nodes.new('ShaderNodeMixRGB')
-                emix1.location = -180, -200
-                drv = emix1.inputs[0].driver_add('default_value')
-                drv.driver.expression = f"{drv_ex}1"
-                if shader.inputs[em_socket].links:
-                    efrm0 = shader.inputs[em_socket].links[0].from_node
-                    efrm0.location = -280, -400
-                    efrm0.hide = True
-                    links.new(efrm0.outputs[0], emix1.inputs[2])
-                else:
-                    efrm0 = None
-                    emix1.inputs[2].default_value = (0,0,0,1)
-                links.new(emix1.outputs[0], shader.inputs[em_socket])
-                shader.inputs['Emission Strength'].default_value = 1.0
-
-            for n, img in enumerate(sorted(anim_seqs[seq_name],
-                                    key=lambda frame: frame.name)):
-                mix0 = mix1
-                mix1 = mat.node_tree.nodes.new('ShaderNodeMixRGB')
-                mix1.location = -180 - 160*(n+1), 220
-                drv = mix1.inputs[0].driver_add('default_value')
-                drv.driver.expression = f"{drv_ex}{n+2}"
-                links.new(mix1.outputs[0], mix0.inputs[1])
-                frm1 = mat.node_tree.nodes.new('ShaderNodeTexImage')
-                frm1.location = -280, 260 + 40*(n+1)
+            links.new(frm0.outputs[0], seq_n.inputs[0])
+            links.new(seq_n.outputs[0], shader.inputs['Base Color'])
+            for n, img in enumerate(frames):
+                frm1 = nodes.new('ShaderNodeTexImage')
+                frm1.location = -460, 260 + 40*(n+1)
                 frm1.hide = True
                 frm1.image = img
                 frm1.interpolation = 'Closest'
-                links.new(frm1.outputs[0], mix1.inputs[2])
+                links.new(frm1.outputs[0], seq_n.inputs[n+1])
 
-                if not has_emit_frames:
-                    continue
-                emix0 = emix1
-                emix1 = mat.node_tree.nodes.new('ShaderNodeMixRGB')
-                emix1.location = -180 - 160*(n+1), -200
-                drv = emix1.inputs[0].driver_add('default_value')
-                drv.driver.expression = f"{drv_ex}{n+2}"
-                links.new(emix1.outputs[0], emix0.inputs[1])
-                if ename not in anim_seqs.keys():
-                    emix1.inputs[2].default_value = (0,0,0,1)
+            # missing emission frames fall back to the black socket default
+            has_emit_frames = ( shader.inputs[em_socket].links
+                                or ename in anim_seqs.keys() )
+            if not has_emit_frames:
+                continue
+            eseq_n = nodes.new('ShaderNodeGroup')
+            eseq_n.node_tree = group
+            eseq_n.location = -180, -200
+            if shader.inputs[em_socket].links:
+                efrm0 = shader.inputs[em_socket].links[0].from_node
+                efrm0.location = -460, -400
+                efrm0.hide = True
+                links.new(efrm0.outputs[0], eseq_n.inputs[0])
+            links.new(eseq_n.outputs[0], shader.inputs[em_socket])
+            shader.inputs['Emission Strength'].default_value = 1.0
+            emits = {emit.name: emit for emit in anim_seqs.get(ename, [])}
+            for n, img in enumerate(frames):
+                emit = emits.get(img.name + emit_suffix)
+                if emit is None:
                     continue
-                for emit in anim_seqs[ename]:
-                    if emit.name == img.name + emit_suffix:
-                        efrm1 = mat.node_tree.nodes.new('ShaderNodeTexImage')
-                        efrm1.location = -280, -400 - 40*(n+1)
-                        efrm1.hide = True
-                        efrm1.image = emit
-                        efrm1.interpolation = 'Closest'
-                        links.new(efrm1.outputs[0], emix1.inputs[2])
-                        break
-                else:
-                    emix1.inputs[2].default_value = (0,0,0,1)
+                efrm1 = nodes.new('ShaderNodeTexImage')
+                efrm1.location = -460, -400 - 40*(n+1)
+                efrm1.hide = True
+                efrm1.image = emit
+                efrm1.interpolation = 'Closest'
+                links.new(efrm1.outputs[0], eseq_n.inputs[n+1])
 
-            links.new(frm0.outputs[0], mix1.inputs[1])
-            if has_emit_frames:
-                if efrm0:
-                    links.new(efrm0.outputs[0], emix1.inputs[1])
-                else:
-                    emix1.inputs[1].default_value = (0,0,0,1)
+    def make_noodles_seq(self, count, fr_dur):
+        # frame switcher, shared by all sequences of the same length
+        name = f"animseq{count}x{fr_dur}"
+        if self.option_lerp:
+            name += "lerp"
+        if name in bpy.data.node_groups:
+            return bpy.data.node_groups[name]
+        fr_mod = count * fr_dur
+        if self.option_lerp:
+            drv_ex = f"-(frame % {fr_mod})/{fr_dur} +"
+        else:
+            drv_ex = f"frame % {fr_mod} < {fr_dur} * "
+        dx = -180
+        group = bpy.data.node_groups.new(name, 'ShaderNodeTree')
+        new_node, new_link = group.nodes.new, group.links.new
+        input = new_node('NodeGroupInput')
+        input.location = (count+1)*dx, 0
+        mix0 = new_node('NodeGroupOutput')
+        self.compat_new_socket(group,'OUT','NodeSocketColor','Color')
+        for n in range(count):
+            socket = self.compat_new_socket(group,'IN','NodeSocketColor',
+                                                            f"Frame {n}")
+            socket.default_value = [0,0,0,1]
+            mix1 = new_node('ShaderNodeMixRGB')
+            mix1.location = (n+1)*dx, 0
+            drv = mix1.inputs[0].driver_add('default_value')
+            drv.driver.expression = f"{drv_ex}{n+1}"
+            new_link(mix1.outputs[0], mix0.inputs[0 if n == 0 else 1])
+            new_link(input.outputs[n], mix1.inputs[2])
+            mix0 = mix1
+        new_link(input.outputs[0], mix1.inputs[1])
+        return group
 
     def make_noodles_pre(self):
         # create node groups for animated water and sky
         fps = bpy.context.scene.render.fps / bpy.context.scene.render.fps_base
-        dx = -180
         waterperiod = 20.0/3.0
         skyperiod = 20.0
         if bpy.context.scene.frame_end == 250: # only change if unmodified
             bpy.context.scene.frame_end = int(skyperiod*fps)
-        if self.option_turb and 'watwarp' not in bpy.data.node_groups:
+
+        # groups built by an earlier import are kept in a per-fps library,
+        # keyed by version so that changes to the builder aren't shadowed
+        cache = bpy.utils.user_resource('CONFIG', path=__name__, create=True)
+        version = '.'.join(map(str, bl_info['version'] + (noodles_version,)))
+        cache = f"{cache}/noodles_{version}_{fps:g}fps.blend"
+        noodles = ('watwarp', 'skycrop', 'skyscroll', 'skydome', 'skyportal')
+        wanted = noodles[:1] if self.option_turb else ()
+        if self.option_scroll:
+            wanted += noodles[1:]
+        existing = set(bpy.data.node_groups.keys())
+        missing = {n for n in wanted if n not in existing}
+        if missing and isfile(cache):
+            try:
+                with bpy.data.libraries.load(cache) as (src, dest):
+                    dest.node_groups = [n for n in src.node_groups
+                                                        if n in missing]
+            except Exception as err:
+                self.report({'WARNING'},f"Could not load node cache: {err}")
+            # dependencies come along too, fold them into groups we have
+            for group in list(bpy.data.node_groups):
+                if group.name in existing:
+                    continue
+                group.use_fake_user = False
+                base = group.name.rpartition('.')[0]
+                if base in existing and base in noodles:
+                    group.user_remap(bpy.data.node_groups[base])
+                    bpy.data.node_groups.remove(group)
+            missing = {n for n in wanted if n not in bpy.data.node_groups}
+        if not missing:
+            return
+        if existing.intersection(noodles):
+            # the file has its own versions, these mustn't leak into the cache
+            self.make_noodles_groups(missing, fps, waterperiod, skyperiod)
+            return
+
+        # clean slate, build the full set so that the cache is complete
+        extra = {n for n in noodles if n not in bpy.data.node_groups}
+        self.make_noodles_groups(extra, fps, waterperiod, skyperiod)
+        groups = {bpy.data.node_groups[n] for n in noodles}
+        try:
+            bpy.data.libraries.write(cache, groups, fake_user=True)
+        except Exception as err:
+            self.report({'WARNING'},f"Could not write node cache: {err}")
+        for n in extra.difference(wanted):
+            bpy.data.node_groups.remove(bpy.data.node_groups[n])
+
+    def make_noodles_groups(self, missing, fps, waterperiod, skyperiod):
+        dx = -180
+        if 'watwarp' in missing:
             group = bpy.data.node_groups.new('watwarp', 'ShaderNodeTree')
-            coord = group.nodes.new('ShaderNodeTexCoord')
+            new_node, new_link = group.nodes.new, group.links.new
+            coord = new_node('ShaderNodeTexCoord')
             coord.location = 6*dx, 0
-            temp2 = group.nodes.new('NodeGroupOutput')
+            temp2 = new_node('NodeGroupOutput')
             self.compat_new_socket(group,'OUT','NodeSocketVectorXYZ','Vector')
-            temp1 = group.nodes.new('ShaderNodeVectorMath')
+            temp1 = new_node('ShaderNodeVectorMath')
             temp1.operation = 'ADD'
             temp1.inputs[1].default_value = (-0.11,-0.27,0.0)
             temp1.location = dx, 0
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-            temp2 = group.nodes.new('ShaderNodeVectorMath')
+            new_link(temp1.outputs[0], temp2.inputs[0])
+            temp2 = new_node('ShaderNodeVectorMath')
             temp2.operation = 'ADD'
             temp2.location = 2*dx, 0
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
-            group.links.new(coord.outputs['UV'], temp2.inputs[0])
-            temp1 = group.nodes.new('ShaderNodeVectorMath')
+            new_link(temp2.outputs[0], temp1.inputs[0])
+            new_link(coord.outputs['UV'], temp2.inputs[0])
+            temp1 = new_node('ShaderNodeVectorMath')
             temp1.operation = 'SCALE'
             temp1.inputs['Scale'].default_value = 0.25
             temp1.location = 3*dx, 64
-            group.links.new(temp1.outputs[0], temp2.inputs[1])
-            temp2 = group.nodes.new('ShaderNodeCombineXYZ')
+            new_link(temp1.outputs[0], temp2.inputs[1])
+            temp2 = new_node('ShaderNodeCombineXYZ')
             temp2.location = 4*dx, 64
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
-            temp1 = group.nodes.new('ShaderNodeTexWave')
+            new_link(temp2.outputs[0], temp1.inputs[0])
+            temp1 = new_node('ShaderNodeTexWave')
             temp1.inputs['Scale'].default_value = math.pi/30
             speed = f"frame*2*pi/({waterperiod}*{fps})"
             drv = temp1.inputs['Phase Offset'].driver_add('default_value')
             drv.driver.expression = speed
             temp1.location = 5*dx, 256
-            group.links.new(coord.outputs['UV'], temp1.inputs['Vector'])
-            group.links.new(temp1.outputs[0], temp2.inputs[1])
-            temp1 = group.nodes.new('ShaderNodeTexWave')
+            new_link(coord.outputs['UV'], temp1.inputs['Vector'])
+            new_link(temp1.outputs[0], temp2.inputs[1])
+            temp1 = new_node('ShaderNodeTexWave')
             temp1.bands_direction = 'Y'
             temp1.inputs['Scale'].default_value = math.pi/30
             speed = "2-" + speed
             drv = temp1.inputs['Phase Offset'].driver_add('default_value')
             drv.driver.expression = speed
             temp1.location = 5*dx, -96
-            group.links.new(coord.outputs['UV'], temp1.inputs['Vector'])
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-        if self.option_scroll and 'skycrop' not in bpy.data.node_groups:
+            new_link(coord.outputs['UV'], temp1.inputs['Vector'])
+            new_link(temp1.outputs[0], temp2.inputs[0])
+        if 'skycrop' in missing:
             # crop a 2x1 texture, resulting in one half repeating twice
             group = bpy.data.node_groups.new('skycrop', 'ShaderNodeTree')
-            input = group.nodes.new('NodeGroupInput')
+            new_node, new_link = group.nodes.new, group.links.new
+            input = new_node('NodeGroupInput')
             input.location = 7*dx, -104
             self.compat_new_socket(group,'IN','NodeSocketVectorXYZ','Vector')
             self.compat_new_socket(group,'IN','NodeSocketFloat','L/R')
-            temp1 = group.nodes.new('NodeGroupOutput')
+            temp1 = new_node('NodeGroupOutput')
             self.compat_new_socket(group,'OUT','NodeSocketVectorXYZ','Vector')
-            temp2 = group.nodes.new('ShaderNodeMixRGB')
+            temp2 = new_node('ShaderNodeMixRGB')
             temp2.location = dx, 0
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
-            temp1 = group.nodes.new('ShaderNodeVectorMath')
+            new_link(temp2.outputs[0], temp1.inputs[0])
+            temp1 = new_node('ShaderNodeVectorMath')
             temp1.operation = 'ADD'
             temp1.location = 4*dx, -128
             temp1.inputs[1].default_value = (0.5,0.0,0.0)
-            group.links.new(input.outputs[0], temp1.inputs[0])
-            group.links.new(input.outputs[0], temp2.inputs[1])
-            group.links.new(temp1.outputs[0], temp2.inputs[2])
-            temp1 = group.nodes.new('ShaderNodeMath')
+            new_link(input.outputs[0], temp1.inputs[0])
+            new_link(input.outputs[0], temp2.inputs[1])
+            new_link(temp1.outputs[0], temp2.inputs[2])
+            temp1 = new_node('ShaderNodeMath')
             temp1.operation = 'ABSOLUTE'
             temp1.location = 2*dx, 32
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-            temp2 = group.nodes.new('ShaderNodeMath')
+            new_link(temp1.outputs[0], temp2.inputs[0])
+            temp2 = new_node('ShaderNodeMath')
             temp2.operation = 'SUBTRACT'
             temp2.location = 3*dx, 32
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
-            group.links.new(input.outputs[1], temp2.inputs[1])
-            temp1 = group.nodes.new('ShaderNodeMath')
+            new_link(temp2.outputs[0], temp1.inputs[0])
+            new_link(input.outputs[1], temp2.inputs[1])
+            temp1 = new_node('ShaderNodeMath')
             temp1.operation = 'LESS_THAN'
             temp1.location = 4*dx, 32
             temp1.inputs[1].default_value = 0.5
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-            temp2 = group.nodes.new('ShaderNodeMath')
+            new_link(temp1.outputs[0], temp2.inputs[0])
+            temp2 = new_node('ShaderNodeMath')
             temp2.operation = 'FRACT'
             temp2.location = 5*dx, 32
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
-            temp1 = group.nodes.new('ShaderNodeSeparateXYZ')
+            new_link(temp2.outputs[0], temp1.inputs[0])
+            temp1 = new_node('ShaderNodeSeparateXYZ')
             temp1.location = 6*dx, 32
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-            group.links.new(input.outputs[0], temp1.inputs[0])
-        if self.option_scroll and 'skyscroll' not in bpy.data.node_groups:
+            new_link(temp1.outputs[0], temp2.inputs[0])
+            new_link(input.outputs[0], temp1.inputs[0])
+        if 'skyscroll' in missing:
             # Q1 sky sphere is supposed to be squashed to a third of its height
             # it may be possible with environment texture node, I didn't bother
             group = bpy.data.node_groups.new('skyscroll', 'ShaderNodeTree')
-            coord = group.nodes.new('ShaderNodeTexCoord')
+            new_node, new_link = group.nodes.new, group.links.new
+            coord = new_node('ShaderNodeTexCoord')
             coord.location = 3*dx, 200
-            temp1 = group.nodes.new('NodeGroupOutput')
+            temp1 = new_node('NodeGroupOutput')
             self.compat_new_socket(group,'OUT','NodeSocketVectorXYZ','BG')
             self.compat_new_socket(group,'OUT','NodeSocketVectorXYZ','FG')
-            temp2 = group.nodes.new('ShaderNodeGroup')
+            temp2 = new_node('ShaderNodeGroup')
             temp2.node_tree = bpy.data.node_groups['skycrop']
             temp2.inputs[1].default_value = 0.0
             temp2.location = dx, 64
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
-            temp1 = group.nodes.new('ShaderNodeMapping')
+            new_link(temp2.outputs[0], temp1.inputs[0])
+            temp1 = new_node('ShaderNodeMapping')
             temp1.location = 2*dx, 160
             temp1.inputs[3].default_value = [1.0, 2.0, 1.0]
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-            group.links.new(coord.outputs['Generated'], temp1.inputs[0])
+            new_link(temp1.outputs[0], temp2.inputs[0])
+            new_link(coord.outputs['Generated'], temp1.inputs[0])
             speed = f"frame/({skyperiod}*{fps})"
-            temp2 = group.nodes.new('ShaderNodeValue')
-            drv = temp2.outputs[0].driver_add('default_value')
+            value = new_node('ShaderNodeValue')
+            drv = value.outputs[0].driver_add('default_value')
             drv.driver.expression=speed
-            temp2.location = 3*dx, -64
-            group.links.new(temp2.outputs[0], temp1.inputs[1])
-            temp1 = group.nodes.new('ShaderNodeMapping')
+            value.location = 3*dx, -64
+            new_link(value.outputs[0], temp1.inputs[1])
+            temp1 = new_node('ShaderNodeMapping')
             temp1.location = 2*dx, -128
             temp1.inputs[3].default_value = [1.0, 2.0, 1.0]
-            group.links.new(coord.outputs['Generated'], temp1.inputs[0])
-            speed = "2*" + speed
-            temp2 = group.nodes.new('ShaderNodeValue')
-            drv = temp2.outputs[0].driver_add('default_value')
-            drv.driver.expression=speed
+            new_link(coord.outputs['Generated'], temp1.inputs[0])
+            temp2 = new_node('ShaderNodeMath') # foreground is twice as fast
+            temp2.operation = 'MULTIPLY'
+            temp2.inputs[1].default_value = 2.0
             temp2.location = 3*dx, -192
-            group.links.new(temp2.outputs[0], temp1.inputs[1])
-            temp2 = group.nodes.new('ShaderNodeGroup')
+            new_link(value.outputs[0], temp2.inputs[0])
+            new_link(temp2.outputs[0], temp1.inputs[1])
+            temp2 = new_node('ShaderNodeGroup')
             temp2.node_tree = bpy.data.node_groups['skycrop']
             temp2.inputs[1].default_value = 1.0
             temp2.location = dx, -64
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
+            new_link(temp1.outputs[0], temp2.inputs[0])
             temp1 = group.nodes['Group Output']
-            group.links.new(temp2.outputs[0], temp1.inputs[1])
-        if self.option_scroll and 'skydome' not in bpy.data.node_groups:
+            new_link(temp2.outputs[0], temp1.inputs[1])
+        if 'skydome' in missing:
             group = bpy.data.node_groups.new('skydome', 'ShaderNodeTree')
-            input = group.nodes.new('NodeGroupInput')
+            new_node, new_link = group.nodes.new, group.links.new
+            input = new_node('NodeGroupInput')
             input.location = 4*dx, 0
             self.compat_new_socket(group,'IN','NodeSocketColor','BG')
             self.compat_new_socket(group,'IN','NodeSocketColor','FG')
-            temp1 = group.nodes.new('ShaderNodeMath')
+            temp1 = new_node('ShaderNodeMath')
             temp1.operation = 'GREATER_THAN'
             temp1.location = 3*dx, -64
             temp1.inputs[1].default_value = 0.0
-            group.links.new(input.outputs[1], temp1.inputs[0])
-            temp2 = group.nodes.new('ShaderNodeMixRGB')
+            new_link(input.outputs[1], temp1.inputs[0])
+            temp2 = new_node('ShaderNodeMixRGB')
             temp2.location = 3*dx, 128
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-            group.links.new(input.outputs[0], temp2.inputs[1])
-            group.links.new(input.outputs[1], temp2.inputs[2])
-            temp1 = group.nodes.new('ShaderNodeBackground')
+            new_link(temp1.outputs[0], temp2.inputs[0])
+            new_link(input.outputs[0], temp2.inputs[1])
+            new_link(input.outputs[1], temp2.inputs[2])
+            temp1 = new_node('ShaderNodeBackground')
             temp1.location = 2*dx, 128
             temp1.inputs[1].default_value = 1.5
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
-            temp2 = group.nodes.new('ShaderNodeMixShader')
+            new_link(temp2.outputs[0], temp1.inputs[0])
+            temp2 = new_node('ShaderNodeMixShader')
             temp2.location = dx, 128
-            group.links.new(temp1.outputs[0], temp2.inputs[1])
-            lpath = group.nodes.new('ShaderNodeLightPath')
+            new_link(temp1.outputs[0], temp2.inputs[1])
+            lpath = new_node('ShaderNodeLightPath')
             lpath.location = 2*dx, -128
-            group.links.new(lpath.outputs['Is Diffuse Ray'], temp2.inputs[0])
-            temp1 = group.nodes.new('ShaderNodeBackground')
+            new_link(lpath.outputs['Is Diffuse Ray'], temp2.inputs[0])
+            temp1 = new_node('ShaderNodeBackground')
             temp1.location = 2*dx, 0
-            group.links.new(temp1.outputs[0], temp2.inputs[2])
+            new_link(temp1.outputs[0], temp2.inputs[2])
             socket = self.compat_new_socket(group,'IN','NodeSocketColor',
                                                             'Amb Color')
             socket.default_value = [0.5,0.5,0.5,1]
-            group.links.new(input.outputs[2], temp1.inputs[0])
+            new_link(input.outputs[2], temp1.inputs[0])
             socket = self.compat_new_socket(group,'IN','NodeSocketFloat',
                                                             'Amb Scale')
             socket.default_value = 1.0
-            group.links.new(input.outputs[3], temp1.inputs[1])
-            temp1 = group.nodes.new('ShaderNodeMixShader')
+            new_link(input.outputs[3], temp1.inputs[1])
+            temp1 = new_node('ShaderNodeMixShader')
             temp1.location = 0, 128
-            group.links.new(temp2.outputs[0], temp1.inputs[1])
-            temp2 = group.nodes.new('ShaderNodeBackground')
+            new_link(temp2.outputs[0], temp1.inputs[1])
+            temp2 = new_node('ShaderNodeBackground')
             temp2.location = dx, 0
-            group.links.new(temp2.outputs[0], temp1.inputs[2])
+            new_link(temp2.outputs[0], temp1.inputs[2])
             socket = self.compat_new_socket(group,'IN','NodeSocketColor',
                                                             'Cam Color')
             socket.default_value = [0.025,0.025,0.025,1]
-            group.links.new(input.outputs[4], temp2.inputs[0])
-            temp2 = group.nodes.new('ShaderNodeMath')
+            new_link(input.outputs[4], temp2.inputs[0])
+            temp2 = new_node('ShaderNodeMath')
             temp2.location = dx, -128
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
+            new_link(temp2.outputs[0], temp1.inputs[0])
             temp2.operation = 'MULTIPLY'
-            group.links.new(lpath.outputs['Is Camera Ray'], temp2.inputs[0])
+            new_link(lpath.outputs['Is Camera Ray'], temp2.inputs[0])
             socket = self.compat_new_socket(group,'IN','NodeSocketFloat',
                                                             'Cam Blend')
             socket.default_value, socket.min_value, socket.max_value = 1, 0, 1
-            group.links.new(input.outputs[5], temp2.inputs[1])
-            temp2 = group.nodes.new('NodeGroupOutput')
+            new_link(input.outputs[5], temp2.inputs[1])
+            temp2 = new_node('NodeGroupOutput')
             self.compat_new_socket(group,'OUT','NodeSocketShader','Background')
             temp2.location = -dx, 128
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-        if self.option_scroll and 'skyportal' not in bpy.data.node_groups:
+            new_link(temp1.outputs[0], temp2.inputs[0])
+        if 'skyportal' in missing:
             group = bpy.data.node_groups.new('skyportal', 'ShaderNodeTree')
-            temp1 = group.nodes.new('NodeGroupOutput')
+            new_node, new_link = group.nodes.new, group.links.new
+            temp1 = new_node('NodeGroupOutput')
             self.compat_new_socket(group,'OUT','NodeSocketShader','Shader')
-            temp2 = group.nodes.new('ShaderNodeMixShader')
+            temp2 = new_node('ShaderNodeMixShader')
             temp2.location = dx, 0
-            group.links.new(temp2.outputs[0], temp1.inputs[0])
-            temp1 = group.nodes.new('ShaderNodeBsdfTransparent')
+            new_link(temp2.outputs[0], temp1.inputs[0])
+            temp1 = new_node('ShaderNodeBsdfTransparent')
             temp1.location = 2*dx, -192
-            group.links.new(temp1.outputs[0], temp2.inputs[2])
-            temp1 = group.nodes.new('ShaderNodeBsdfGlass')
+            new_link(temp1.outputs[0], temp2.inputs[2])
+            temp1 = new_node('ShaderNodeBsdfGlass')
             temp1.location = 2*dx, 0
             if bpy.app.version < (4,0,0): temp1.distribution = 'SHARP'
             temp1.inputs['IOR'].default_value = 1.0
-            group.links.new(temp1.outputs[0], temp2.inputs[1])
-            temp1 = group.nodes.new('ShaderNodeMath')
+            new_link(temp1.outputs[0], temp2.inputs[1])
+            temp1 = new_node('ShaderNodeMath')
             temp1.operation = 'MAXIMUM'
             temp1.location = 2*dx, 192
-            group.links.new(temp1.outputs[0], temp2.inputs[0])
-            temp2 = group.nodes.new('ShaderNodeLightPath')
+            new_link(temp1.outputs[0], temp2.inputs[0])
+            temp2 = new_node('ShaderNodeLightPath')
             temp2.location = 3*dx, 64
-            group.links.new(temp2.outputs['Is Shadow Ray'],temp1.inputs[0])
-            group.links.new(temp2.outputs['Is Reflection Ray'],temp1.inputs[1])
+            new_link(temp2.outputs['Is Shadow Ray'],temp1.inputs[0])
+            new_link(temp2.outputs['Is Reflection Ray'],temp1.inputs[1])
 
 
 class ResetTexelDensity(bpy.types.Operator):
@@ -704,14 +863,19 @@ class ResetTexelDensity(bpy.types.Operator):
     option_box: BoolProperty(name="Box Project", default=False,
                             description="Box-project before applying density")
 
-    def calc_area_2d(self, coords):
-        x, y = zip(*coords)
-        return 0.5*abs(sum( x[i]*(y[i+1]-y[i-1]) for i in range(-1,len(x)-1) ))
+    def calc_area_2d(self, coords, starts):
+        # shoelace over many polygons stored back to back, one area per start
+        nxt = np.arange(1, len(coords) + 1)
+        nxt[np.append(starts[1:], len(coords)) - 1] = starts # close polygons
+        x, y = coords.T
+        nx, ny = coords[nxt].T
+        return 0.5*np.abs(np.add.reduceat(x*ny - nx*y, starts))
 
     def execute(self, context):
         if self.option_box:
             bpy.ops.uv.cube_project()
         mat_area = dict()
+        tex_area = dict() # by image, several materials may share one
         objs = bpy.context.selected_objects
         if not objs:
             objs = [bpy.context.active_object]
@@ -726,41 +890,72 @@ class ResetTexelDensity(bpy.types.Operator):
                 if mat and mat.name not in mat_area:
                     mat_area[mat.name] = dict()
                     mat_area[mat.name]['uv'] = mat_area[mat.name]['3d'] = 0
-                    width = height = 64
+                    mat_area[mat.name]['tex'] = 64 * 64
                     if mat.node_tree:
                         for node in mat.node_tree.nodes:
-                            if node.type == 'TEX_IMAGE':
-                                if node.image.has_data:
-                                    width, height = node.image.size
-                                    break
-                    mat_area[mat.name]['tex'] = width * height
+                            if node.type != 'TEX_IMAGE': continue
+                            img = node.image
+                            area = tex_area.get(img.name_full)
+                            if area is None:
+                                w, h = img.size if img.has_data else (0, 0)
+                                area = tex_area[img.name_full] = w * h
+                            if area:
+                                mat_area[mat.name]['tex'] = area
+                                break
 
             # measure area
+            faces = []
+            face_mat = []
+            slot_mats = [slot.material and slot.material.name
+                            for slot in obj.material_slots]
             for face in bm.faces:
                 if not face.select: continue
-                mat = obj.material_slots[face.material_index].material
-                if mat is None: continue
-                loop_uvs = [loop[uv_layer].uv for loop in face.loops]
-                mat_area[mat.name]['uv'] += self.calc_area_2d(loop_uvs)
-                mat_area[mat.name]['3d'] += face.calc_area()
+                mat_name = slot_mats[face.material_index]
+                if mat_name is None: continue
+                faces.append(face)
+                face_mat.append(mat_name)
+            if not faces: continue
+            loops = [loop[uv_layer] for face in faces for loop in face.loops]
+            sizes = np.array([len(face.loops) for face in faces])
+            starts = np.cumsum(sizes) - sizes
+            loop_uvs = chain.from_iterable(loop.uv for loop in loops)
+            loop_uvs = np.fromiter(loop_uvs, np.float64, 2*len(loops))
+            loop_uvs = loop_uvs.reshape(-1, 2)
+            areas_uv = self.calc_area_2d(loop_uvs, starts)
+            areas_3d = np.fromiter((face.calc_area() for face in faces),
+                                    np.float64, len(faces))
+            mat_names, face_mat = np.unique(face_mat, return_inverse=True)
+            sums_uv = np.bincount(face_mat, areas_uv, len(mat_names))
+            sums_3d = np.bincount(face_mat, areas_3d, len(mat_names))
+            for mat_name, area_uv, area_3d in zip(mat_names, sums_uv, sums_3d):
+                mat_area[mat_name]['uv'] += area_uv
+                mat_area[mat_name]['3d'] += area_3d
 
-            # apply density
-            for face in bm.faces:
-                if not face.select: continue
-                mat = obj.material_slots[face.material_index].material
-                if mat is None: continue
-                area = mat_area[mat.name]
-                mult = math.sqrt( area['3d'] / (area['tex'] * area['uv']) )
-                mult *= self.option_scale
-                loop_uvs = [loop[uv_layer].uv for loop in face.loops]
-                for uv in loop_uvs:
-                    uv *= mult
+            # apply density, degenerate (zero area) materials are left as is
+            mult = np.ones(len(mat_names))
+            for i, area in enumerate(map(mat_area.get, mat_names)):
+                if area['uv'] > 0 and area['3d'] > 0:
+                    mult[i] = math.sqrt(area['3d'] / (area['tex']*area['uv']))
+                    mult[i] *= self.option_scale
+            loop_uvs *= np.repeat(mult[face_mat], sizes)[:,None]
+            for loop, uv in zip(loops, loop_uvs.tolist()):
+                loop.uv = uv
 
-            bmesh.update_edit_mesh(obj.data)
+            bmesh.update_edit_mesh(obj.data, loop_triangles=False,
+                                                    destructive=False)
 
         return {'FINISHED'}
 
 
+# materials appended from asset libraries, reused instead of appending again
+appended_assets = dict()
+asset_path_split = re.compile(r'[\\/]Material[\\/]').split
+
+@persistent
+def forget_appended_assets(*args):
+    # names are only meaningful within the file they were appended to
+    appended_assets.clear()
+
 class ApplyAssetEditMode(bpy.types.Operator):
     bl_idname = 'asset.apply_to_faces'
     bl_label = "Apply to Selection"
@@ -780,12 +975,19 @@ class ApplyAssetEditMode(bpy.types.Operator):
         if mat is None:
             lib_path = context.preferences.filepaths.asset_libraries.get(
                     context.area.spaces.active.params.asset_library_ref).path
-            mat_path = context.active_file.relative_path.split('\\Material/')
-            blend_path = f"{lib_path}\\{mat_path[0]}"
-            with bpy.data.libraries.load(blend_path) as (src, dest):
-                dest.materials = [mat_path[1]]
-            mat = bpy.data.materials[mat_path[1]]
-            mat.asset_clear()
+            rel_path = context.active_file.relative_path
+            asset = os.path.join(lib_path, rel_path)
+            mat = bpy.data.materials.get(appended_assets.get(asset, ''))
+            # the name may have been taken over by an unrelated material
+            if mat is None or mat.get('wad_asset_source') != asset:
+                blend_file, mat_name = asset_path_split(rel_path, maxsplit=1)
+                blend_path = os.path.join(lib_path, blend_file)
+                with bpy.data.libraries.load(blend_path) as (src, dest):
+                    dest.materials = [mat_name]
+                mat = dest.materials[0]
+                mat.asset_clear()
+                mat['wad_asset_source'] = asset
+                appended_assets[asset] = mat.name
 
         objs = bpy.context.selected_objects
         if not objs:
@@ -796,10 +998,13 @@ class ApplyAssetEditMode(bpy.types.Operator):
                 obj.data.materials.append(mat)
                 mat_idx = len(obj.data.materials) - 1
             bm = bmesh.from_edit_mesh(obj.data)
-            for face in bm.faces:
-                if face.select:
-                    face.material_index = mat_idx
-            bmesh.update_edit_mesh(obj.data)
+            faces = [face for face in bm.faces
+                        if face.select and face.material_index != mat_idx]
+            for face in faces:
+                face.material_index = mat_idx
+            if faces: # skip the resync for objects that didn't change
+                bmesh.update_edit_mesh(obj.data, loop_triangles=False,
+                                                    destructive=False)
         return {'FINISHED'}
 
 
@@ -821,8 +1026,10 @@ def register():
     bpy.types.VIEW3D_MT_uv_map.append(menu_func_uv)
     if bpy.app.version > (3,0,0):
         bpy.types.ASSETBROWSER_MT_context_menu.prepend(menu_func_asset)
+    bpy.app.handlers.load_post.append(forget_appended_assets)
 
 def unregister():
+    bpy.app.handlers.load_post.remove(forget_appended_assets)
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
     bpy.types.VIEW3D_MT_uv_map.remove(menu_func_uv)
     if bpy.app.version > (3,0,0):
@@ -897,3 +1104,6 @@ quake1palette = [0,0,0,          15,15,15,       31,31,31,       47,47,47,
                  127,191,255,    171,231,255,    215,255,255,    103,0,0,
                  139,0, 0,       179,0,0,        215,0,0,        255,0,0,
                  255,243,147,    255,247,199,    255,255,255,    159,91,83]
+
+quake1palette_rgba = palette_to_rgba(bytes(quake1palette))
+quake1palette_rgba.flags.writeable = False # shared by every import